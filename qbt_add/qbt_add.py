@@ -1,16 +1,22 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
 import argparse
+import base64
+import hashlib
+import http.client
+import json
 import os
 import re
+import ssl
 import sys
+import tempfile
 import time
 import uuid
-from typing import Dict, List, Optional, Tuple
-from urllib.parse import urlparse
-
-import requests
-import yaml
+from http.cookies import SimpleCookie
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
 
 
 def parse_args() -> argparse.Namespace:
@@ -55,183 +61,577 @@ def parse_args() -> argparse.Namespace:
         "--timeout",
         type=int,
         default=20,
-        help="Seconds to wait for the torrent to appear after add (default: %(default)s)",
+        help="Seconds to wait for qBittorrent to register the torrent after add (default: %(default)s)",
     )
     return parser.parse_args()
 
 
-def qb_login(session: requests.Session, base_url: str, username: Optional[str], password: Optional[str]) -> None:
+class _Response(NamedTuple):
+    status_code: int
+    text: str
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class _QbtClient:
+    """Minimal qBittorrent WebUI client on http.client with a single keep-alive connection.
+
+    All calls are made sequentially on one connection, which is reopened when the server has
+    dropped it between requests. Not thread-safe.
+    """
+
+    def __init__(self, base_url: str, verify: bool = True, timeout: float = 20) -> None:
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            print(f"Error: Invalid --host URL: {base_url}", file=sys.stderr)
+            sys.exit(2)
+        self._https = parts.scheme == "https"
+        self._host = parts.hostname
+        self._port = parts.port
+        # WebUI may be served under a sub-path by a reverse proxy
+        self._prefix = parts.path.rstrip("/")
+        self._timeout = timeout
+        self._context: Optional[ssl.SSLContext] = None
+        if self._https:
+            self._context = ssl.create_default_context()
+            if not verify:
+                self._context.check_hostname = False
+                self._context.verify_mode = ssl.CERT_NONE
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._cookies: Dict[str, str] = {}
+
+    def __enter__(self) -> _QbtClient:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        conn: http.client.HTTPConnection
+        if self._https:
+            conn = http.client.HTTPSConnection(self._host, self._port, timeout=self._timeout, context=self._context)
+        else:
+            conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout)
+        return conn
+
+    def get(self, path: str, params: Optional[Dict[str, str]] = None) -> _Response:
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        return self._request("GET", path)
+
+    def post(
+        self, path: str, data: Optional[Dict[str, str]] = None, files: Optional[Dict[str, Tuple[str, bytes, str]]] = None
+    ) -> _Response:
+        """POST form data; files maps a field to (filename, content, content type) and is sent as multipart."""
+        if files:
+            body, content_type = _multipart_body(data or {}, files)
+            return self._request("POST", path, body=body, content_type=content_type)
+        body = urlencode(data or {}).encode()
+        return self._request("POST", path, body=body, content_type="application/x-www-form-urlencoded")
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[bytes] = None,
+        content_type: Optional[str] = None,
+    ) -> _Response:
+        headers = {"User-Agent": "qbt_add", "Connection": "keep-alive"}
+        if self._cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self._cookies.items())
+        if content_type:
+            headers["Content-Type"] = content_type
+        for attempt in range(2):
+            reused = self._conn is not None
+            if self._conn is None:
+                self._conn = self._connect()
+            conn = self._conn
+            try:
+                conn.request(method, self._prefix + path, body=body, headers=headers)
+                resp = conn.getresponse()
+                raw = resp.read()
+            except (ConnectionError, ssl.SSLEOFError):
+                self.close()
+                # The server may drop an idle keep-alive connection; retry once on a fresh one
+                if reused and attempt == 0:
+                    continue
+                raise
+            except BaseException:
+                # Never reuse a connection left in an unknown state
+                self.close()
+                raise
+            break
+        for header in resp.msg.get_all("Set-Cookie") or []:
+            cookie: SimpleCookie = SimpleCookie()
+            cookie.load(header)
+            for name, morsel in cookie.items():
+                self._cookies[name] = morsel.value
+        return _Response(resp.status, raw.decode("utf-8", "replace"))
+
+
+def _multipart_body(fields: Dict[str, str], files: Dict[str, Tuple[str, bytes, str]]) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts: List[bytes] = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, ctype) in files.items():
+        filename = filename.replace('"', "%22")
+        head = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f"Content-Type: {ctype}\r\n\r\n"
+        )
+        parts.extend((head.encode(), content, b"\r\n"))
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def qb_login(client: _QbtClient, username: Optional[str], password: Optional[str]) -> None:
     if not username or not password:
         print("Error: Missing username/password. Provide --username/--password or env QBT_USERNAME/QBT_PASSWORD.", file=sys.stderr)
         sys.exit(2)
-    resp = session.post(f"{base_url}/api/v2/auth/login", data={"username": username, "password": password})
+    resp = client.post("/api/v2/auth/login", data={"username": username, "password": password})
     if resp.status_code != 200 or resp.text != "Ok.":
         print(f"Error: Login failed (status {resp.status_code}): {resp.text}", file=sys.stderr)
         sys.exit(1)
 
 
-def qb_add_source(session: requests.Session, base_url: str, source: str, tag: str, paused: bool = True) -> None:
+def qb_add_source(client: _QbtClient, source: str, torrent_data: Optional[bytes] = None, paused: bool = True) -> None:
     if source.startswith("magnet:?"):
         data = {
             "paused": "true" if paused else "false",
-            "tags": tag,
             "urls": source,
         }
-        resp = session.post(f"{base_url}/api/v2/torrents/add", data=data)
+        resp = client.post("/api/v2/torrents/add", data=data)
     else:
-        if not os.path.isfile(source):
-            print(f"Error: File not found: {source}", file=sys.stderr)
-            sys.exit(2)
-        with open(source, "rb") as f:
-            files = {"torrents": (os.path.basename(source), f, "application/x-bittorrent")}
-            data = {
-                "paused": "true" if paused else "false",
-                "tags": tag,
-            }
-            resp = session.post(f"{base_url}/api/v2/torrents/add", data=data, files=files)
+        if torrent_data is None:
+            torrent_data = read_torrent_file(source)
+        files = {"torrents": (os.path.basename(source), torrent_data, "application/x-bittorrent")}
+        data = {
+            "paused": "true" if paused else "false",
+        }
+        resp = client.post("/api/v2/torrents/add", data=data, files=files)
     if resp.status_code != 200:
         print(f"Error: Failed to add torrent (status {resp.status_code}): {resp.text}", file=sys.stderr)
         sys.exit(1)
+    if resp.text.strip() == "Fails.":
+        # qB answers 200 "Fails." when it rejects the torrent, typically because it is already added;
+        # stop here instead of applying rules to (and resuming) the existing torrent
+        print("Error: qBittorrent rejected the torrent (already added or invalid).", file=sys.stderr)
+        sys.exit(1)
 
 
-def qb_find_torrents_by_tag(session: requests.Session, base_url: str, tag: str) -> List[Dict]:
-    resp = session.get(f"{base_url}/api/v2/torrents/info", params={"tag": tag})
-    if resp.status_code != 200:
-        raise RuntimeError(f"Failed to query torrents by tag: {resp.status_code} {resp.text}")
-    return resp.json()
+def _bencode_end(data: bytes, pos: int) -> int:
+    # Return the offset just past the bencoded value starting at pos
+    c = data[pos:pos + 1]
+    if c == b"i":
+        return data.index(b"e", pos) + 1
+    if c in (b"l", b"d"):
+        pos += 1
+        while data[pos:pos + 1] != b"e":
+            if pos >= len(data):
+                raise ValueError("unterminated list/dict")
+            pos = _bencode_end(data, pos)
+        return pos + 1
+    if c.isdigit():
+        colon = data.index(b":", pos)
+        return colon + 1 + int(data[pos:colon])
+    raise ValueError(f"invalid bencode at offset {pos}")
+
+
+def _bencode_dict_spans(data: bytes, pos: int) -> Dict[bytes, Tuple[int, int]]:
+    # Map each key of the bencoded dict at pos to the (start, end) span of its raw value
+    if data[pos:pos + 1] != b"d":
+        raise ValueError("expected a dict")
+    spans: Dict[bytes, Tuple[int, int]] = {}
+    pos += 1
+    while data[pos:pos + 1] != b"e":
+        key_end = _bencode_end(data, pos)
+        key = data[data.index(b":", pos) + 1:key_end]
+        value_end = _bencode_end(data, key_end)
+        spans[key] = (key_end, value_end)
+        pos = value_end
+    return spans
+
+
+def read_torrent_file(path: str) -> bytes:
+    if not os.path.isfile(path):
+        print(f"Error: File not found: {path}", file=sys.stderr)
+        sys.exit(2)
+    with open(path, "rb") as f:
+        return f.read()
+
 
+def compute_infohash(source: str, torrent_data: Optional[bytes] = None) -> str:
+    """Return the hash qBittorrent will use for a magnet URI or .torrent file, without asking qB."""
+    if source.startswith("magnet:?"):
+        m = re.search(r"[?&]xt=urn:btih:([0-9A-Za-z]+)", source)
+        if m:
+            btih = m.group(1)
+            if len(btih) == 40 and re.fullmatch(r"[0-9A-Fa-f]{40}", btih):
+                return btih.lower()
+            if len(btih) == 32:
+                try:
+                    return base64.b32decode(btih.upper()).hex()
+                except ValueError:
+                    pass
+        # v2-only magnet: qB identifies the torrent by the truncated SHA-256 info hash
+        m = re.search(r"[?&]xt=urn:btmh:1220([0-9A-Fa-f]{64})", source)
+        if m:
+            return m.group(1)[:40].lower()
+        print(f"Error: Magnet URI has no usable info hash: {source}", file=sys.stderr)
+        sys.exit(2)
 
-def qb_get_trackers(session: requests.Session, base_url: str, torrent_hash: str) -> List[Dict]:
-    resp = session.get(f"{base_url}/api/v2/torrents/trackers", params={"hash": torrent_hash})
+    data = torrent_data if torrent_data is not None else read_torrent_file(source)
+    try:
+        start, end = _bencode_dict_spans(data, 0)[b"info"]
+        info = data[start:end]
+        info_keys = _bencode_dict_spans(data, start)
+    except (KeyError, IndexError, ValueError, RecursionError) as e:
+        print(f"Error: Invalid .torrent file {source}: {e}", file=sys.stderr)
+        sys.exit(2)
+    # Hash the raw info bytes as stored; re-encoding could differ from what the client hashes
+    if b"pieces" not in info_keys and b"meta version" in info_keys:
+        return hashlib.sha256(info).hexdigest()[:40]
+    return hashlib.sha1(info).hexdigest()
+
+
+def qb_wait_for_torrent(client: _QbtClient, torrent_hash: str, timeout: float) -> bool:
+    # qB usually registers the torrent within ~100ms of the add call returning
+    deadline = time.time() + timeout
+    while True:
+        resp = client.get("/api/v2/torrents/properties", params={"hash": torrent_hash})
+        if resp.status_code == 200:
+            return True
+        if resp.status_code != 404:
+            raise RuntimeError(f"Failed to query torrent properties: {resp.status_code} {resp.text}")
+        if time.time() >= deadline:
+            return False
+        time.sleep(0.1)
+
+
+def qb_get_trackers(client: _QbtClient, torrent_hash: str) -> List[Dict]:
+    resp = client.get("/api/v2/torrents/trackers", params={"hash": torrent_hash})
     if resp.status_code != 200:
         raise RuntimeError(f"Failed to fetch trackers: {resp.status_code} {resp.text}")
     return resp.json()
 
 
+# scheme://[userinfo@]host -- host is a bracketed IPv6 literal or runs up to the port/path
+_HOST_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.\-]*://(?:[^@/?#]*@)?(\[[^\]/?#]*\]|[^/:?#]+)")
+
+
 def extract_hostnames_from_trackers(trackers: List[Dict]) -> List[str]:
     hosts: List[str] = []
     for tr in trackers:
-        url = tr.get("url", "")
-        if not url:
-            continue
-        try:
-            parsed = urlparse(url)
-            if parsed.hostname:
-                hosts.append(parsed.hostname)
-        except Exception:
-            continue
+        # Pseudo-trackers like "** [DHT] **" have no scheme and do not match
+        m = _HOST_RE.match(tr.get("url") or "")
+        if m:
+            hosts.append(m.group(1).strip("[]").lower())
     # Ensure unique order-preserving
-    seen = set()
-    unique_hosts = []
-    for h in hosts:
-        if h not in seen:
-            seen.add(h)
-            unique_hosts.append(h)
-    return unique_hosts
+    return list(dict.fromkeys(hosts))
+
+
+# Bump when the structure of the on-disk rules cache changes so stale caches are ignored
+_RULES_CACHE_VERSION = 6
+
+# In-process cache for callers that load rules repeatedly (e.g. importing this module in a
+# batch runner): path -> ((mtime_ns, size), processed config)
+_RULES_CACHE: Dict[str, Tuple[Tuple[int, int], Dict]] = {}
+
+
+def _load_rules_cache(cache_path: str, key: Tuple[int, int]) -> Optional[Dict]:
+    # The cache holds plain parsed YAML as JSON, so a tampered file can at worst change the rules,
+    # and only a file we own that nobody else can write is trusted even for that
+    try:
+        fd = os.open(cache_path, os.O_RDONLY | getattr(os, "O_NOFOLLOW", 0))
+    except OSError:
+        return None
+    try:
+        with os.fdopen(fd, "r", encoding="utf-8") as f:
+            st = os.fstat(f.fileno())
+            if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o022):
+                return None
+            cached = json.load(f)
+    except (OSError, ValueError):
+        # Unreadable or corrupt: just re-parse
+        return None
+    if not isinstance(cached, dict) or cached.get("version") != _RULES_CACHE_VERSION or cached.get("key") != list(key):
+        return None
+    data = cached.get("data")
+    if not isinstance(data, dict) or not isinstance(data.get("defaults"), dict) or not isinstance(data.get("rules"), list):
+        return None
+    return data
+
+
+def _save_rules_cache(cache_path: str, key: Tuple[int, int], data: Dict) -> None:
+    try:
+        payload = json.dumps({"version": _RULES_CACHE_VERSION, "key": list(key), "data": data})
+    except (TypeError, ValueError):
+        # YAML values JSON cannot represent (e.g. dates): don't cache
+        return
+    try:
+        # mkstemp creates the file with O_EXCL and mode 0600, so a planted symlink is never followed
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".", prefix=".rules-cache-", suffix=".tmp")
+    except OSError:
+        # Cache is best-effort, e.g. the rules directory may be read-only
+        return
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
 
 def load_rules(path: str) -> Dict:
     if not os.path.isfile(path):
         print(f"Error: Rules file not found: {path}", file=sys.stderr)
         sys.exit(2)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _RULES_CACHE.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    # The parsed YAML is cached as JSON next to the rules file, keyed by its mtime and size
+    cache_path = path + ".cache.json"
+    data = _load_rules_cache(cache_path, key)
+    if data is None:
+        data = _parse_rules_yaml(path)
+        _save_rules_cache(cache_path, key, data)
+    # Regexes are compiled fresh on every load; only plain data ever comes from disk
+    data.update(compile_rules(data["rules"], data["defaults"]))
+    _RULES_CACHE[path] = (key, data)
+    return data
+
+
+def _parse_rules_yaml(path: str) -> Dict:
+    # Imported only on a cache miss so --help, argument errors and warm runs skip it
+    import yaml
+
+    try:
+        # libyaml C binding, several times faster than the pure-Python loader
+        from yaml import CSafeLoader as _YamlLoader
+    except ImportError:
+        from yaml import SafeLoader as _YamlLoader  # type: ignore[assignment]
+
     with open(path, "r", encoding="utf-8") as f:
         try:
-            data = yaml.safe_load(f) or {}
+            loaded = yaml.load(f, Loader=_YamlLoader)
         except yaml.YAMLError as e:
             print(f"Error: Failed to parse YAML rules: {e}", file=sys.stderr)
             sys.exit(2)
-    data.setdefault("defaults", {})
-    data.setdefault("rules", [])
+    data: Dict[str, Any] = {"defaults": {}, "rules": []}
+    if loaded:
+        # An empty "rules:" or "defaults:" key loads as None; keep the defaults above for those
+        data.update({k: v for k, v in loaded.items() if v is not None})
     return data
 
 
-def match_rules(hosts: List[str], rules_cfg: Dict) -> Tuple[Optional[str], Optional[int]]:
+# Global inline flags such as (?i) cannot be embedded in a larger alternation
+_GLOBAL_FLAGS_RE = re.compile(r"^\(\?[aiLmsux]+\)")
+
+
+def compile_rules(rules: List[Dict], defaults: Dict) -> Dict:
+    # Index rules once so matching does a dict lookup plus a single combined regex match.
+    # All structures keep the rule's position so "first matching rule wins" still holds.
+    exact: Dict[str, int] = {}
+    suffix_trie: Dict = {}
+    suffix_indexes: List[int] = []
+    fusable: List[Tuple[int, str]] = []
+    regex: List[Tuple[int, "re.Pattern[str]"]] = []
+    for index, rule in enumerate(rules):
+        match = rule.get("match")
+        match_regex = rule.get("match_regex")
+        suffix = rule.get("suffix")
+        if match:
+            # Tracker hosts are lowercased on extraction; hostnames are case-insensitive
+            exact.setdefault(str(match).lower(), index)
+        if suffix:
+            labels = str(suffix).lower().lstrip("*").strip(".").split(".")
+            if "" in labels:
+                # "*", "." or "a..b" would leave an empty label that matches no real host
+                print(f"Warning: Skipping rule #{index + 1}, invalid suffix {suffix!r}", file=sys.stderr)
+                continue
+            # Reversed-label trie: "example.com" is stored as com -> example; the None key marks a rule
+            node = suffix_trie
+            for label in reversed(labels):
+                node = node.setdefault(label, {})
+            node.setdefault(None, index)
+            suffix_indexes.append(index)
+        if match_regex:
+            try:
+                pattern = re.compile(match_regex)
+            except (re.error, TypeError) as e:
+                # Invalid patterns are dropped here once, so matching never has to guard against them
+                print(f"Warning: Skipping rule #{index + 1}, invalid match_regex {match_regex!r}: {e}", file=sys.stderr)
+                continue
+            # Capture groups are renumbered inside the fused pattern, which breaks backreferences and
+            # conditionals such as \1 or (?(1)...); keep any pattern with groups on its own
+            if pattern.groups or _GLOBAL_FLAGS_RE.match(match_regex):
+                regex.append((index, pattern))
+            else:
+                fusable.append((index, match_regex))
+
+    # One anchored alternation: ".*?" lets each branch start anywhere like re.search, and since
+    # branches are tried in order the lowest rule index wins. The branch name carries the index.
+    mega: Optional["re.Pattern[str]"] = None
+    if fusable:
+        try:
+            mega = re.compile("|".join(f"(?P<_r{index}>.*?(?:{pattern}))" for index, pattern in fusable))
+        except re.error:
+            regex = sorted(regex + [(index, re.compile(pattern)) for index, pattern in fusable])
+
+    # Exact rules placed before every suffix/regex rule can win without any further matching
+    first_non_exact = min(
+        suffix_indexes + [index for index, _ in regex] + [index for index, _ in fusable], default=None
+    )
+
+    # What each rule (and the no-match case) applies is also fixed at load time
+    results = [_rule_result(rule) for rule in rules]
+    return {
+        "exact": exact,
+        "first_non_exact": first_non_exact,
+        "suffix_trie": suffix_trie,
+        "mega": mega,
+        "regex": regex,
+        "results": results,
+        "default_result": _default_result(defaults),
+    }
+
+
+def _rule_result(rule: Dict) -> Tuple[Optional[str], Optional[int]]:
     category: Optional[str] = None
     up_limit_kib: Optional[int] = None
+    if "category" in rule and rule["category"]:
+        category = rule["category"]
+    if "up_limit_kib" in rule:
+        try:
+            up_limit_kib = int(rule["up_limit_kib"])
+        except (TypeError, ValueError):
+            pass
+    return category, up_limit_kib
 
-    rules: List[Dict] = rules_cfg.get("rules", [])
 
-    for host in hosts:
-        for rule in rules:
-            match = rule.get("match")
-            match_regex = rule.get("match_regex")
-            is_hit = False
-            if match and host == match:
-                is_hit = True
-            elif match_regex:
-                try:
-                    if re.search(match_regex, host):
-                        is_hit = True
-                except re.error:
-                    # Skip invalid regex rules
-                    pass
-            if is_hit:
-                if "category" in rule and rule["category"]:
-                    category = rule["category"]
-                if "up_limit_kib" in rule:
-                    try:
-                        up_limit_kib = int(rule["up_limit_kib"])
-                    except (TypeError, ValueError):
-                        pass
-                # First matching rule wins
-                return category, up_limit_kib
-
-    defaults = rules_cfg.get("defaults", {})
-    if category is None and defaults.get("category"):
+def _default_result(defaults: Dict) -> Tuple[Optional[str], Optional[int]]:
+    category: Optional[str] = None
+    up_limit_kib: Optional[int] = None
+    if defaults.get("category"):
         category = defaults.get("category")
-    if up_limit_kib is None and "up_limit_kib" in defaults:
+    if "up_limit_kib" in defaults:
         try:
             up_limit_kib = int(defaults.get("up_limit_kib", 0))
         except (TypeError, ValueError):
             up_limit_kib = None
-
     return category, up_limit_kib
 
 
-def qb_get_categories(session: requests.Session, base_url: str) -> Dict:
-    resp = session.get(f"{base_url}/api/v2/torrents/categories")
-    if resp.status_code != 200:
-        raise RuntimeError(f"Failed to fetch categories: {resp.status_code} {resp.text}")
-    return resp.json()
-
+def _match_suffix(trie: Dict, host: str) -> Optional[int]:
+    # Walk the host's labels from the TLD inwards; any rule seen on the way is a suffix of the host
+    hit: Optional[int] = None
+    node = trie
+    for label in reversed(host.split(".")):
+        child = node.get(label)
+        if child is None:
+            break
+        node = child
+        index = node.get(None)
+        if index is not None and (hit is None or index < hit):
+            hit = index
+    return hit
 
-def qb_create_category_if_missing(session: requests.Session, base_url: str, category: str) -> None:
-    if not category:
-        return
-    cats = qb_get_categories(session, base_url)
-    if category in cats:
-        return
-    resp = session.post(f"{base_url}/api/v2/torrents/createCategory", data={"category": category})
-    if resp.status_code != 200:
-        # If already exists or cannot be created, warn but continue
-        print(f"Warning: createCategory returned {resp.status_code}: {resp.text}", file=sys.stderr)
 
+def match_rules(hosts: List[str], rules_cfg: Dict) -> Tuple[Optional[str], Optional[int]]:
+    exact: Dict[str, int] = rules_cfg["exact"]
+    first_non_exact: Optional[int] = rules_cfg["first_non_exact"]
+    suffix_trie: Dict = rules_cfg["suffix_trie"]
+    mega: Optional["re.Pattern[str]"] = rules_cfg["mega"]
+    regex: List[Tuple[int, "re.Pattern[str]"]] = rules_cfg["regex"]
+    results: List[Tuple[Optional[str], Optional[int]]] = rules_cfg["results"]
 
-def qb_set_category(session: requests.Session, base_url: str, torrent_hash: str, category: str) -> None:
+    for host in hosts:
+        hit = exact.get(host)
+        if hit is not None and (first_non_exact is None or hit < first_non_exact):
+            return results[hit]
+        if suffix_trie:
+            index = _match_suffix(suffix_trie, host)
+            if index is not None and (hit is None or index < hit):
+                hit = index
+        if mega is not None:
+            m = mega.match(host)
+            if m and m.lastgroup:
+                index = int(m.lastgroup[2:])
+                if hit is None or index < hit:
+                    hit = index
+        for index, pattern in regex:
+            # A regex rule only wins if it comes before the current hit
+            if hit is not None and index > hit:
+                break
+            if pattern.search(host):
+                hit = index
+                break
+        if hit is not None:
+            # First matching rule wins
+            return results[hit]
+
+    return rules_cfg["default_result"]
+
+
+def qb_create_category_if_missing(client: _QbtClient, category: str) -> Optional[str]:
+    # Returns a warning held back because the 409 may only mean the category already exists
     if not category:
-        return
-    resp = session.post(f"{base_url}/api/v2/torrents/setCategory", data={"hashes": torrent_hash, "category": category})
+        return None
+    resp = client.post("/api/v2/torrents/createCategory", data={"category": category})
+    if resp.status_code == 200 or "already in use" in resp.text:
+        return None
+    warning = f"Warning: createCategory returned {resp.status_code}: {resp.text}"
+    if resp.status_code == 409 and resp.text.strip() == "Unable to create category":
+        # qB answers this for an existing category and for a real failure alike; the setCategory
+        # that follows tells them apart without a categories lookup
+        return warning
+    # Other errors (e.g. "Incorrect category name"): warn but continue
+    print(warning, file=sys.stderr)
+    return None
+
+
+def qb_set_category(client: _QbtClient, torrent_hash: str, category: str) -> bool:
+    if not category:
+        return True
+    resp = client.post("/api/v2/torrents/setCategory", data={"hashes": torrent_hash, "category": category})
     if resp.status_code != 200:
         print(f"Warning: setCategory failed ({resp.status_code}): {resp.text}", file=sys.stderr)
+        return False
+    return True
 
 
-def qb_set_upload_limit(session: requests.Session, base_url: str, torrent_hash: str, limit_kib_per_s: Optional[int]) -> None:
+def qb_apply_category(client: _QbtClient, torrent_hash: str, category: str) -> None:
+    # setCategory fails for unknown categories, so these two must stay in order
+    held_warning = qb_create_category_if_missing(client, category)
+    if not qb_set_category(client, torrent_hash, category) and held_warning:
+        # The category really was missing, so the createCategory refusal was an error after all
+        print(held_warning, file=sys.stderr)
+
+
+def qb_set_upload_limit(client: _QbtClient, torrent_hash: str, limit_kib_per_s: Optional[int]) -> None:
     if limit_kib_per_s is None:
         return
     # qB expects bytes/sec. KiB/s -> bytes/s
     limit_bytes = max(0, int(limit_kib_per_s) * 1024)
-    resp = session.post(f"{base_url}/api/v2/torrents/setUploadLimit", data={"hashes": torrent_hash, "limit": str(limit_bytes)})
+    resp = client.post("/api/v2/torrents/setUploadLimit", data={"hashes": torrent_hash, "limit": str(limit_bytes)})
     if resp.status_code != 200:
         print(f"Warning: setUploadLimit failed ({resp.status_code}): {resp.text}", file=sys.stderr)
 
 
-def qb_remove_tag(session: requests.Session, base_url: str, torrent_hash: str, tag: str) -> None:
-    resp = session.post(f"{base_url}/api/v2/torrents/removeTags", data={"hashes": torrent_hash, "tags": tag})
-    # Ignore non-200, tag removal is best-effort
-
-
-def qb_resume(session: requests.Session, base_url: str, torrent_hash: str) -> None:
-    resp = session.post(f"{base_url}/api/v2/torrents/resume", data={"hashes": torrent_hash})
+def qb_resume(client: _QbtClient, torrent_hash: str) -> None:
+    resp = client.post("/api/v2/torrents/resume", data={"hashes": torrent_hash})
     if resp.status_code != 200:
         print(f"Warning: resume failed ({resp.status_code}): {resp.text}", file=sys.stderr)
 
@@ -239,58 +639,57 @@ def qb_resume(session: requests.Session, base_url: str, torrent_hash: str) -> No
 def main() -> None:
     args = parse_args()
 
-    session = requests.Session()
-    session.verify = not args.insecure
-
-    qb_login(session, args.host, args.username, args.password)
-
-    rules_cfg = load_rules(args.config)
-
-    unique_tag = f"qbt-rules-{uuid.uuid4()}"
-
-    qb_add_source(session, args.host, args.source, unique_tag, paused=True)
-
-    # Poll for the new torrent to appear under our unique tag
-    deadline = time.time() + args.timeout
-    torrents: List[Dict] = []
-    while time.time() < deadline:
-        torrents = qb_find_torrents_by_tag(session, args.host, unique_tag)
-        if torrents:
-            break
-        time.sleep(0.5)
-
-    if not torrents:
-        print("Error: Added torrent not found by tag within timeout.", file=sys.stderr)
-        sys.exit(1)
-
-    # Assume only one source per run; use the first
-    torrent = torrents[0]
-    torrent_hash = torrent.get("hash")
-
-    trackers = qb_get_trackers(session, args.host, torrent_hash)
-    hosts = extract_hostnames_from_trackers(trackers)
-
-    category, up_limit_kib = match_rules(hosts, rules_cfg)
-
-    if category:
-        qb_create_category_if_missing(session, args.host, category)
-        qb_set_category(session, args.host, torrent_hash, category)
-
-    qb_set_upload_limit(session, args.host, torrent_hash, up_limit_kib)
-
-    qb_remove_tag(session, args.host, torrent_hash, unique_tag)
-
-    if not args.no_unpause:
-        qb_resume(session, args.host, torrent_hash)
-
-    applied = []
-    if category:
-        applied.append(f"category={category}")
-    if up_limit_kib is not None:
-        applied.append(f"up_limit_kib={up_limit_kib}")
-    applied_str = ", ".join(applied) if applied else "no rules applied"
-
-    print(f"Applied: {applied_str}. Hosts: {', '.join(hosts) if hosts else 'none'}")
+    # Read once: the same bytes are hashed here and uploaded by qb_add_source
+    torrent_data: Optional[bytes] = None
+    if not args.source.startswith("magnet:?"):
+        torrent_data = read_torrent_file(args.source)
+    torrent_hash = compute_infohash(args.source, torrent_data)
+
+    # All calls go to the same WebUI host over one kept-alive connection
+    with _QbtClient(args.host, verify=not args.insecure) as client:
+        qb_login(client, args.username, args.password)
+
+        rules_cfg = load_rules(args.config)
+
+        qb_add_source(client, args.source, torrent_data, paused=True)
+
+        if not qb_wait_for_torrent(client, torrent_hash, args.timeout):
+            print(f"Error: Added torrent {torrent_hash} not found within timeout.", file=sys.stderr)
+            sys.exit(1)
+
+        hosts: Optional[List[str]] = None
+        if rules_cfg["rules"]:
+            trackers = qb_get_trackers(client, torrent_hash)
+            hosts = extract_hostnames_from_trackers(trackers)
+            category, up_limit_kib = match_rules(hosts, rules_cfg)
+        else:
+            # Only defaults configured: tracker hosts cannot change the outcome, skip the lookup
+            category, up_limit_kib = rules_cfg["default_result"]
+
+        # Sent back to back on the one warm connection. Overlapping setUploadLimit with the
+        # createCategory -> setCategory chain needs a second connection, which only pays off without
+        # TLS (~1 RTT saved); over https its handshake eats the gain
+        if category:
+            qb_apply_category(client, torrent_hash, category)
+        qb_set_upload_limit(client, torrent_hash, up_limit_kib)
+
+        # Resume only once the rules are in place so the torrent never starts with the wrong settings
+        if not args.no_unpause:
+            qb_resume(client, torrent_hash)
+
+        applied = []
+        if category:
+            applied.append(f"category={category}")
+        if up_limit_kib is not None:
+            applied.append(f"up_limit_kib={up_limit_kib}")
+        applied_str = ", ".join(applied) if applied else "no rules applied"
+
+        if hosts is None:
+            hosts_str = "not checked (no rules)"
+        else:
+            hosts_str = ", ".join(hosts) if hosts else "none"
+
+        print(f"Applied: {applied_str}. Hosts: {hosts_str}")
 
 
 if __name__ == "__main__":